@@ -25,17 +25,28 @@
 # ==========================================================
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ConnectTimeoutError
+import asyncio
 import time
 import threading
 from urllib.parse import quote
 import html
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont  # pip install pillow
+from collections import OrderedDict
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 import json
+import types
 import os
 import math
+import atexit
+import hashlib
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 
 # ==============================
 #  Bot / Monitoring Settings
@@ -50,9 +61,13 @@ ALLOWED_CHAT_IDS = [
     # "987654321",
 ]
 
+# String form for fast lookups in is_allowed_chat_id()
+ALLOWED_CHAT_IDS_SET = frozenset(str(x) for x in ALLOWED_CHAT_IDS)
+
 CONFIG = {
     "interval": 600,   # auto-monitoring interval in seconds (e.g. 600 = 10 minutes)
     "max_nodes": 50,   # max nodes to request from Check-Host
+    "concurrency": 8,  # max targets monitored in parallel
     "targets": [
         {"host": "https://yourdomain.com", "mode": "http"},
         {"host": "yourdomain.com", "mode": "ping"},
@@ -60,14 +75,36 @@ CONFIG = {
     ]
 }
 
+# CONFIG fields bound once at start-up, so hot paths read attributes
+# instead of indexing the dict on every call
+CFG = types.SimpleNamespace(
+    interval=CONFIG["interval"],
+    max_nodes=CONFIG["max_nodes"],
+    concurrency=CONFIG.get("concurrency", 8),
+    targets=tuple(CONFIG["targets"]),
+)
+
 CHECKHOST_BASE = "https://check-host.net"
 CHECKHOST_RESULT = f"{CHECKHOST_BASE}/check-result/"
+TELEGRAM_API_BASE = "https://api.telegram.org"
 
 STATS_FILE = "monitor_stats.json"
 
+# Append-only journal of the batches merged since STATS_FILE was last
+# written; replayed on load and emptied when STATS_FILE is rewritten
+STATS_LOG_FILE = STATS_FILE + ".log"
+
+# How often STATS_FILE is rewritten (compacting the journal), in seconds
+STATS_COMPACT_INTERVAL = 3600
+
 # Minimum number of samples required before anomaly detection
 MIN_SAMPLES = 20
 
+# Baselines weigh at most this many samples; past it, older samples fade
+# out so the model follows slow drift (e.g. a permanent route change).
+# 1000 samples ~ 1 week at a 10 minute interval.
+BASELINE_MAX_SAMPLES = 1000
+
 # For time/rtt: how many standard deviations above mean is considered anomaly
 SIGMA_THRESHOLD = 3.0
 
@@ -78,21 +115,75 @@ FACTOR_THRESHOLD = 2.0  # e.g. >= 2x the mean
 LOSS_BASELINE_MAX = 0.05        # baseline loss mean <= 5%
 LOSS_ABSOLUTE_THRESHOLD = 0.10  # current loss >= 10%
 
+# Loss that is not an anomaly is still reported ("Loss Detected") from here on
+LOSS_ALERT_THRESHOLD = 0.20     # current loss >= 20%
+
+# A (target, location, metric) that keeps alerting is repeated at most this often (seconds)
+ALERT_COOLDOWN = 1800
+
+
+# ==============================
+#  Shared HTTP sessions
+# ==============================
+def make_session(pool_connections: int, pool_maxsize: int, headers: dict = None,
+                 max_retries=0) -> requests.Session:
+    """Keep-alive session so repeated calls reuse the same TLS connection."""
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=max_retries,
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+# One session per remote host, each with its own connection pool. The
+# check-host pool is sized so every concurrently monitored target (plus
+# command handlers) keeps its own keep-alive connection. Its GETs retry
+# failed connects with a short backoff, but never read timeouts: a
+# /check-* GET that reached check-host has already started a check, and
+# repeating it would launch a duplicate and burn API quota. Telegram
+# POSTs are retried by telegram_post() instead.
+CHECKHOST_POOL_SIZE = max(16, 2 * CFG.concurrency)
+CHECKHOST_SESSION = make_session(
+    2,
+    CHECKHOST_POOL_SIZE,
+    headers={"Accept": "application/json"},
+    max_retries=Retry(total=2, read=0, backoff_factor=0.3),
+)
+TELEGRAM_SESSION = make_session(2, 16)
+
 
 # ==============================
 #  Simple Check-Host API wrapper
 # ==============================
+class CheckNotStarted(requests.ConnectionError):
+    """A /check-* request that never connected to check-host, so no check was started."""
+
+
 class ReqApi:
     def reqapi_ch_get_request(self, target: str, method: str, max_nodes: int = 30) -> dict:
         # method: ping, http, tcp
         url = f"{CHECKHOST_BASE}/check-{method}?host={quote(target)}&max_nodes={max_nodes}"
-        r = requests.get(url, headers={"Accept": "application/json"}, timeout=15)
-        return r.json()
+        try:
+            r = CHECKHOST_SESSION.get(url, timeout=15)
+        except requests.ConnectionError as e:
+            # Connect timeouts and refused / unresolvable hosts (urllib3's
+            # NewConnectionError is a ConnectTimeoutError) fail before the
+            # request is sent; anything later may have started the check
+            reason = getattr(e.args[0], "reason", None) if e.args else None
+            if isinstance(reason, ConnectTimeoutError):
+                raise CheckNotStarted(*e.args, request=e.request) from e
+            raise
+        return json.loads(r.content)
 
     def reqapi_ch_get_result(self, request_id: str) -> dict:
         url = CHECKHOST_RESULT + str(request_id)
-        r = requests.get(url, headers={"Accept": "application/json"}, timeout=15)
-        return r.json()
+        r = CHECKHOST_SESSION.get(url, timeout=15)
+        return json.loads(r.content)
 
 
 reqapi = ReqApi()
@@ -101,46 +192,184 @@ reqapi = ReqApi()
 # ==============================
 #  Statistics & Modeling
 # ==============================
+def migrate_stats(stats):
+    """Convert old Welford cells {n, mean, M2} to running sums {n, s, s2} in place."""
+    for targets in stats.values():
+        for locations in targets.values():
+            for metrics in locations.values():
+                for metric_name, cell in metrics.items():
+                    if "mean" not in cell:
+                        continue
+                    n = cell.get("n", 0)
+                    mean = cell.get("mean", 0.0)
+                    M2 = cell.get("M2", 0.0)
+                    metrics[metric_name] = {
+                        "n": n,
+                        "s": n * mean,
+                        "s2": M2 + n * mean * mean,
+                    }
+    return stats
+
+
 def load_stats():
+    """
+    Returns (stats, seq): the stats in STATS_FILE and the sequence number
+    of the last journaled batch already folded into them.
+    """
     if not os.path.exists(STATS_FILE):
-        return {}
+        return {}, 0
     try:
-        with open(STATS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(STATS_FILE, "rb") as f:
+            data = json.loads(f.read())
+        if "seq" in data and "stats" in data:
+            return migrate_stats(data["stats"]), data["seq"]
+        # files written before the journal: bare stats, no sequence
+        return migrate_stats(data), 0
     except Exception:
-        return {}
+        return {}, 0
+
+
+# Digest of the last stats file written, to skip identical rewrites
+_last_stats_digest = None
 
 
-def save_stats(stats):
+def _flush_stats_locked(stats, seq: int) -> bool:
+    """
+    Write stats, which include every journaled batch up to seq, to a temp
+    file and swap it in (caller holds _FLUSH_LOCK). Returns True once
+    STATS_FILE holds exactly these stats.
+    """
+    global _last_stats_digest
+
+    tmp_file = STATS_FILE + ".tmp"
     try:
-        with open(STATS_FILE, "w", encoding="utf-8") as f:
-            json.dump(stats, f, ensure_ascii=False, indent=2)
+        # json.dumps without indent runs on the C encoder; json.dump with
+        # indent falls back to the pure-Python one
+        blob = json.dumps(
+            {"seq": seq, "stats": stats}, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        digest = hashlib.blake2b(blob, digest_size=16).digest()
+        if digest == _last_stats_digest:
+            return True
+        with open(tmp_file, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_file, STATS_FILE)
+        _last_stats_digest = digest
+        return True
     except Exception:
         # do not crash the bot because of stats I/O
+        return False
+
+
+def append_stats_log(mode: str, target: str, cycle: dict):
+    """
+    Journal one batch merged into STATS[mode][target] under the next
+    sequence number (caller holds that stripe).
+    """
+    global _stats_seq
+
+    cells = [
+        [location, metric_name, c["n"], c["s"], c["s2"]]
+        for (location, metric_name), c in cycle.items()
+    ]
+    with _LOG_LOCK:
+        _stats_seq += 1
+        line = json.dumps(
+            [_stats_seq, mode, target, cells], ensure_ascii=False, separators=(",", ":")
+        )
+        try:
+            with open(STATS_LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception:
+            pass
+
+
+def drop_stats_log():
+    try:
+        os.remove(STATS_LOG_FILE)
+    except OSError:
         pass
 
 
-STATS = load_stats()
-STATS_LOCK = threading.Lock()
+# _stats_seq: sequence number of the last batch merged into STATS. The
+# stats file records the one it includes, so a journal left behind by a
+# crash between the rewrite and drop_stats_log() isn't replayed twice.
+STATS, _stats_seq = load_stats()
 
+# STATS[mode][target] subtrees are guarded by one of these striped locks,
+# so updates for unrelated targets don't wait on each other.
+_STATS_STRIPES = [threading.Lock() for _ in range(16)]
+_FLUSH_LOCK = threading.Lock()
+_LOG_LOCK = threading.Lock()  # taken inside a stripe, never the other way round
 
-def welford_update(metric_stats, value: float):
-    n = metric_stats.get("n", 0)
-    mean = metric_stats.get("mean", 0.0)
-    M2 = metric_stats.get("M2", 0.0)
-
-    n_new = n + 1
-    delta = value - mean
-    mean_new = mean + delta / n_new
-    delta2 = value - mean_new
-    M2_new = M2 + delta * delta2
-
-    metric_stats["n"] = n_new
-    metric_stats["mean"] = mean_new
-    metric_stats["M2"] = M2_new
+
+def _lock_for(mode: str, target: str):
+    return _STATS_STRIPES[hash((mode, target)) % len(_STATS_STRIPES)]
+
+
+@contextmanager
+def all_stats_locks():
+    """Hold every stripe (always in the same order) for a consistent view of STATS."""
+    with ExitStack() as stack:
+        for lock in _STATS_STRIPES:
+            stack.enter_context(lock)
+        yield
+
+# Updates append to the journal and mark STATS dirty; the full file is
+# only rewritten by maybe_flush_stats()
+_stats_dirty = False
+_last_flush_ts = 0.0
+
+
+def maybe_flush_stats(min_interval: float = STATS_COMPACT_INTERVAL):
+    """
+    Rewrite STATS_FILE and empty the journal, if STATS changed and the
+    last rewrite is older than min_interval.
+    """
+    global _stats_dirty, _last_flush_ts
+
+    with _FLUSH_LOCK:
+        if not _stats_dirty:
+            return
+        now = time.time()
+        if now - _last_flush_ts < min_interval:
+            return
+        # With every stripe held no batch can be merged or journaled, so
+        # the file written here is STATS exactly and the journal can go
+        with all_stats_locks():
+            if _flush_stats_locked(STATS, _stats_seq):
+                drop_stats_log()
+                _stats_dirty = False
+        _last_flush_ts = now
+
+
+# Make sure the last updates reach the disk on a clean shutdown
+atexit.register(maybe_flush_stats, 0.0)
+
+
+def add_sample(metric_stats, value: float):
+    """
+    Running sums: n, s = sum(x), s2 = sum(x^2). No division per sample;
+    mean / variance are derived only when needed. Values here are seconds
+    or 0-1 loss rates, so cancellation in s2 - s^2/n is not a concern.
+    """
+    metric_stats["n"] = metric_stats.get("n", 0) + 1
+    metric_stats["s"] = metric_stats.get("s", 0.0) + value
+    metric_stats["s2"] = metric_stats.get("s2", 0.0) + value * value
     return metric_stats
 
 
+def mean_std(n: int, s: float, s2: float):
+    """Mean and sample standard deviation from running sums (plain scalars)."""
+    if n <= 0:
+        return 0.0, 0.0
+    mean = s / n
+    if n == 1:
+        return mean, 0.0
+    variance = (s2 - s * mean) / (n - 1)
+    return mean, math.sqrt(max(variance, 0.0))
+
+
 def check_anomaly(metric_stats, value: float, metric_name: str):
     """
     Different anomaly criteria for different metrics:
@@ -148,22 +377,15 @@ def check_anomaly(metric_stats, value: float, metric_name: str):
     - loss: baseline almost zero, now significantly higher
     """
     n = metric_stats.get("n", 0)
-    mean = metric_stats.get("mean", 0.0)
-    M2 = metric_stats.get("M2", 0.0)
-
     if n < MIN_SAMPLES:
         return False, None
 
+    mean, std = mean_std(n, metric_stats.get("s", 0.0), metric_stats.get("s2", 0.0))
+
     # Special handling for loss (packet loss in ping)
     if metric_name == "loss":
         # Baseline mean was low (e.g. <= 5%), now loss is high (>= 10%)
         if mean <= LOSS_BASELINE_MAX and value >= LOSS_ABSOLUTE_THRESHOLD:
-            if n > 1:
-                variance = M2 / (n - 1)
-                std = math.sqrt(max(variance, 0.0))
-            else:
-                std = 0.0
-
             factor = value / max(mean, 1e-6)
             z_score = (value - mean) / std if std > 0 else None
 
@@ -180,12 +402,6 @@ def check_anomaly(metric_stats, value: float, metric_name: str):
     if mean <= 0:
         return False, None
 
-    if n > 1:
-        variance = M2 / (n - 1)
-        std = math.sqrt(max(variance, 0.0))
-    else:
-        std = 0.0
-
     factor = value / mean
     z_score = (value - mean) / std if std > 0 else None
 
@@ -206,6 +422,162 @@ def check_anomaly(metric_stats, value: float, metric_name: str):
     }
 
 
+def cap_stats(cell, max_n: int = BASELINE_MAX_SAMPLES):
+    """
+    Scale a running-sum cell down to max_n samples. Mean and variance are
+    kept; each later sample then replaces 1/max_n of the history.
+    """
+    n = cell.get("n", 0)
+    if n <= max_n:
+        return cell
+    k = max_n / n
+    return {
+        "n": max_n,
+        "s": cell.get("s", 0.0) * k,
+        "s2": cell.get("s2", 0.0) * k,
+    }
+
+
+def combine_stats(a, b):
+    """Merge two running-sum states; the same as adding b's samples one by one to a."""
+    return {
+        "n": a.get("n", 0) + b.get("n", 0),
+        "s": a.get("s", 0.0) + b.get("s", 0.0),
+        "s2": a.get("s2", 0.0) + b.get("s2", 0.0),
+    }
+
+
+def replay_stats_log(stats, seq: int):
+    """
+    Fold journaled batches newer than seq into stats, in order.
+    Returns (batches applied, last sequence number seen).
+    """
+    try:
+        with open(STATS_LOG_FILE, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0, seq
+
+    end = data.rfind(b"\n") + 1
+    if end < len(data):
+        # Torn last line from a crash mid-append: cut it off so the next
+        # append starts on a line of its own
+        data = data[:end]
+        try:
+            with open(STATS_LOG_FILE, "r+b") as f:
+                f.truncate(end)
+        except OSError:
+            pass
+
+    applied = 0
+    for line in data.splitlines():
+        try:
+            line_seq, mode, target, cells = json.loads(line)
+        except ValueError:
+            continue
+        if line_seq <= seq:
+            # already in STATS_FILE
+            continue
+        seq = line_seq
+        locations = stats.setdefault(mode, {}).setdefault(target, {})
+        for location, metric_name, n, s, s2 in cells:
+            metrics = locations.setdefault(location, {})
+            metrics[metric_name] = cap_stats(
+                combine_stats(metrics.get(metric_name, {}), {"n": n, "s": s, "s2": s2})
+            )
+        applied += 1
+    return applied, seq
+
+
+# Batches journaled since STATS_FILE was last written aren't in it yet
+_replayed, _stats_seq = replay_stats_log(STATS, _stats_seq)
+if _replayed:
+    _stats_dirty = True
+
+
+def update_target_and_detect(mode: str, target: str, locations, metric_names, values):
+    """
+    Columnar batch for one (mode, target): parallel lists of location,
+    metric name and value. Returns a list of (is_anomaly, details), one
+    per sample, in order.
+
+    Every sample is checked against the model as it was before this batch,
+    then the batch is merged into STATS under the target's stripe lock.
+    An empty batch (every node failed) leaves STATS and the journal alone.
+    """
+    global _stats_dirty
+
+    if not values:
+        return []
+
+    # Per-cycle model for this target, built outside the lock
+    cycle = {}
+    for key, value in zip(zip(locations, metric_names), values):
+        cycle[key] = add_sample(cycle.get(key, {}), value)
+
+    results = []
+    with _lock_for(mode, target):
+        target_stats = STATS.setdefault(mode, {}).setdefault(target, {})
+
+        # Check anomalies against the current (pre-merge) model
+        for location, metric_name, value in zip(locations, metric_names, values):
+            metric_stats = target_stats.get(location, {}).get(metric_name)
+            if metric_stats is None or metric_stats["n"] < MIN_SAMPLES:
+                # still warming up: nothing to compare against yet
+                results.append((False, None))
+            else:
+                results.append(check_anomaly(metric_stats, value, metric_name))
+
+        # Fold this cycle's samples into the persisted model. Cells are
+        # replaced, never mutated, so snapshots can share the old ones.
+        for (location, metric_name), cycle_stats in cycle.items():
+            metrics = target_stats.setdefault(location, {})
+            metrics[metric_name] = cap_stats(
+                combine_stats(metrics.get(metric_name, {}), cycle_stats)
+            )
+        append_stats_log(mode, target, cycle)
+
+        _stats_dirty = True
+
+    return results
+
+
+def _copy_locations(locations):
+    return {location: dict(metrics) for location, metrics in locations.items()}
+
+
+def snapshot_stats(mode_filter=None, target_filter=None):
+    """
+    Consistent copy of STATS for readers. Only the dict levels are copied;
+    metric cells are shared since updates swap in new cells.
+    With filters, only the matching subtree is copied (same filter rules
+    as iter_stats_entries); a single (mode, target) only takes its stripe.
+    """
+    if mode_filter and target_filter:
+        with _lock_for(mode_filter, target_filter):
+            locations = STATS.get(mode_filter, {}).get(target_filter)
+            if locations is None:
+                return {}
+            return {mode_filter: {target_filter: _copy_locations(locations)}}
+
+    with all_stats_locks():
+        if mode_filter:
+            modes = [(mode_filter, STATS[mode_filter])] if mode_filter in STATS else []
+        else:
+            modes = STATS.items()
+        snapshot = {}
+        for mode, targets in modes:
+            if target_filter:
+                if target_filter in targets:
+                    snapshot[mode] = {target_filter: _copy_locations(targets[target_filter])}
+            else:
+                snapshot[mode] = {
+                    target: _copy_locations(locations)
+                    for target, locations in targets.items()
+                }
+        return snapshot
+
+
 def update_and_detect(mode: str, target: str, location: str, metric_name: str, value: float):
     """
     mode: 'http' / 'ping' / 'tcp'
@@ -214,37 +586,13 @@ def update_and_detect(mode: str, target: str, location: str, metric_name: str, v
     metric_name: 'time' / 'rtt' / 'loss'
     value: new observed value
     """
-    global STATS
-
-    with STATS_LOCK:
-        STATS.setdefault(mode, {})
-        STATS[mode].setdefault(target, {})
-        STATS[mode][target].setdefault(location, {})
-        metric_stats = STATS[mode][target][location].get(
-            metric_name, {"n": 0, "mean": value, "M2": 0.0}
-        )
-
-        # Check anomaly against current model
-        is_anomaly, details = check_anomaly(metric_stats, value, metric_name)
-
-        # Update model with new value
-        metric_stats = welford_update(metric_stats, value)
-        STATS[mode][target][location][metric_name] = metric_stats
-        save_stats(STATS)
-
-    return is_anomaly, details
+    return update_target_and_detect(mode, target, [location], [metric_name], [value])[0]
 
 
 def format_metric_stats(metric_name: str, stats: dict) -> str:
     """Pretty-print metrics (for debug / future use)."""
     n = stats.get("n", 0)
-    mean = stats.get("mean", 0.0)
-    M2 = stats.get("M2", 0.0)
-    if n > 1:
-        variance = M2 / (n - 1)
-        std = math.sqrt(max(variance, 0.0))
-    else:
-        std = 0.0
+    mean, std = mean_std(n, stats.get("s", 0.0), stats.get("s2", 0.0))
 
     if metric_name == "loss":
         mean_txt = f"{mean * 100:.2f} %"
@@ -259,27 +607,98 @@ def format_metric_stats(metric_name: str, stats: dict) -> str:
     )
 
 
+# ==============================
+#  HTML Escaping Helper
+# ==============================
+# Node names, locations, IPs and status texts repeat across nodes and
+# cycles, so their escaped form is cached
+escape_cached = functools.lru_cache(maxsize=4096)(html.escape)
+
+
+@functools.lru_cache(maxsize=1024)
+def node_info_lines(node_name: str) -> str:
+    """The "Node" and "Node info" (ip-info link) lines for a node, built once per node."""
+    node_esc = html.escape(node_name)
+    return (
+        f"🛰 Node: <code>{node_esc}</code>\n"
+        "🔗 Node info: "
+        f"<code>{CHECKHOST_BASE}/ip-info?host={node_esc}</code>\n"
+    )
+
+
 # ==============================
 #  HTML Message Splitting Helper
 # ==============================
+# Closes each node's section in the check reports
+NODE_SEPARATOR = "------------------------------------"
+
+
+def _count_line_chunks(lines, start: int, max_len: int) -> int:
+    """How many chunks greedy whole-line packing needs for lines[start:]."""
+    count = 0
+    cur_len = None  # None while no chunk is open
+    for line in itertools.islice(lines, start, None):
+        if cur_len is not None and cur_len + 1 + len(line) > max_len:
+            cur_len = None
+        if cur_len is not None:
+            cur_len += 1 + len(line)
+        elif line:
+            # never start a chunk with blank lines
+            count += 1
+            cur_len = len(line)
+    return count
+
+
 def split_html_message(text: str, max_len: int = 3900):
+    """
+    Split text into Telegram-sized chunks of whole lines (tags never span
+    lines, so every chunk stays valid HTML), using no more messages than
+    plain line packing. Within that budget, chunks break at natural
+    boundaries: sections end at a blank line (report header, one alert) or
+    a NODE_SEPARATOR line (one node of a check report), and a section that
+    doesn't fit in the current chunk starts the next one whole.
+    """
     lines = text.split("\n")
+    max_chunks = _count_line_chunks(lines, 0, max_len)
+
+    # (start, end) line ranges of the sections
+    sections = []
+    start = 0
+    for idx, line in enumerate(lines):
+        if not line or line == NODE_SEPARATOR:
+            sections.append((start, idx + 1))
+            start = idx + 1
+    if start < len(lines):
+        sections.append((start, len(lines)))
+
     chunks = []
-    current = ""
-
-    for line in lines:
-        add_len = len(line) + (1 if current else 0)
-        if len(current) + add_len > max_len:
-            if current:
-                chunks.append(current)
-                current = ""
-        if current:
-            current += "\n" + line
-        else:
-            current = line
+    # Lines of the current chunk and its joined length
+    buf = []
+    cur_len = 0
+
+    for start, end in sections:
+        size = sum(len(line) for line in lines[start:end]) + end - start - 1
+        if (buf and size <= max_len and cur_len + 1 + size > max_len
+                and len(chunks) + 1 + _count_line_chunks(lines, start, max_len) <= max_chunks):
+            chunks.append("\n".join(buf))
+            buf = []
+            cur_len = 0
+        for line in lines[start:end]:
+            if buf and cur_len + 1 + len(line) > max_len:
+                chunks.append("\n".join(buf))
+                buf = []
+                cur_len = 0
+            if buf:
+                cur_len += 1 + len(line)
+            elif line:
+                # never start a chunk with blank lines
+                cur_len = len(line)
+            else:
+                continue
+            buf.append(line)
 
-    if current:
-        chunks.append(current)
+    if buf:
+        chunks.append("\n".join(buf))
 
     return chunks
 
@@ -288,9 +707,7 @@ def split_html_message(text: str, max_len: int = 3900):
 #  Telegram Helper Functions
 # ==============================
 def is_allowed_chat_id(chat_id) -> bool:
-    if chat_id is None:
-        return False
-    return str(chat_id) in {str(x) for x in ALLOWED_CHAT_IDS}
+    return chat_id is not None and str(chat_id) in ALLOWED_CHAT_IDS_SET
 
 
 async def send_large_async(update: Update, text: str):
@@ -301,31 +718,114 @@ async def send_large_async(update: Update, text: str):
         await update.message.reply_text(chunk, parse_mode="HTML")
 
 
+class TelegramRateLimiter:
+    """
+    Spaces out auto-monitor sends to stay under Telegram's flood limits:
+    at most one message per per_chat_interval seconds to the same chat
+    and global_rate messages per second overall. Thread-safe; acquire()
+    reserves the next free slot and sleeps until it comes up.
+    """
+
+    def __init__(self, per_chat_interval: float = 1.0, global_rate: float = 25.0):
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate
+        self._lock = threading.Lock()
+        self._next_global = 0.0
+        self._next_chat = {}  # chat_id -> earliest time of its next send
+
+    def acquire(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+            self._next_global = slot + self.global_interval
+            self._next_chat[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def defer(self, chat_id, seconds: float):
+        """Hold back every send to chat_id for the next `seconds` (429 retry_after)."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._next_chat[chat_id] = max(self._next_chat.get(chat_id, 0.0), until)
+
+
+TELEGRAM_LIMITER = TelegramRateLimiter()
+TELEGRAM_MAX_ATTEMPTS = 5
+
+
+def telegram_post(url: str, chat_id, timeout: float, **kwargs):
+    """
+    POST one Bot API call for chat_id through the rate limiter. On
+    429 Too Many Requests, wait the advertised retry_after and resend
+    instead of dropping the message.
+    """
+    for _ in range(TELEGRAM_MAX_ATTEMPTS):
+        TELEGRAM_LIMITER.acquire(chat_id)
+        r = TELEGRAM_SESSION.post(url, timeout=timeout, **kwargs)
+        if r.status_code != 429:
+            return r
+        try:
+            retry_after = float(r.json()["parameters"]["retry_after"])
+        except Exception:
+            retry_after = 5.0
+        TELEGRAM_LIMITER.defer(chat_id, retry_after)
+    return r
+
+
+# Fans auto-monitor sends out to all chats at once
+TELEGRAM_POOL = ThreadPoolExecutor(max_workers=8)
+
+
+def for_each_chat(send_one):
+    """
+    Call send_one(chat_id) for every allowed chat in parallel and wait for
+    all of them. Messages to the same chat keep their order.
+    """
+    if len(ALLOWED_CHAT_IDS) == 1:
+        send_one(ALLOWED_CHAT_IDS[0])
+        return
+    futures = [TELEGRAM_POOL.submit(send_one, chat_id) for chat_id in ALLOWED_CHAT_IDS]
+    for future in futures:
+        future.result()
+
+
 def telegram_send_sync(text: str):
     """Send text messages synchronously (auto-monitor)."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    for chat_id in ALLOWED_CHAT_IDS:
-        for chunk in split_html_message(text):
-            requests.post(url, json={
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendMessage"
+    # Split once; every chat gets the same chunks
+    chunks = split_html_message(text)
+
+    def send_one(chat_id):
+        for chunk in chunks:
+            telegram_post(url, chat_id, timeout=15, json={
                 "chat_id": chat_id,
                 "text": chunk,
                 "parse_mode": "HTML"
             })
 
+    for_each_chat(send_one)
+
 
 def telegram_send_photo(image_io: BytesIO, caption: str):
     """Send images synchronously (auto-monitor)."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
-    files = {
-        "photo": ("result.png", image_io.getvalue(), "image/png")
-    }
-    for chat_id in ALLOWED_CHAT_IDS:
-        data = {
-            "chat_id": chat_id,
-            "caption": caption,
-            "parse_mode": "HTML"
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendPhoto"
+
+    # A read-only view of the PNG bytes (no getvalue() copy), shared by
+    # every chat's multipart body
+    with image_io.getbuffer() as photo:
+        files = {
+            "photo": ("result.png", photo, "image/png")
         }
-        requests.post(url, data=data, files=files)
+
+        def send_one(chat_id):
+            data = {
+                "chat_id": chat_id,
+                "caption": caption,
+                "parse_mode": "HTML"
+            }
+            telegram_post(url, chat_id, timeout=30, data=data, files=files)
+
+        for_each_chat(send_one)
 
 
 def send_large_auto(text: str):
@@ -346,33 +846,34 @@ def clean_host_for_ping(url_or_host: str) -> str:
 # ==============================
 #  Poll Check-Host results with retries
 # ==============================
-def wait_for_result(request_id: str, expected_nodes: int, retries: int = 10, delay: float = 2.0) -> dict:
+def wait_for_result(request_id: str, expected_nodes: int, retries: int = 12,
+                    delay: float = 2.0, initial_delay: float = 0.5) -> dict:
     """
     Call /check-result multiple times until:
     - we have data for all expected nodes, or
     - we run out of retries.
+
+    The wait between calls starts at initial_delay and grows by 1.5x up
+    to delay, so fast checks return early while slow ones get the same
+    total budget (~20 s) as before.
     """
     last_data = {}
+    wait = initial_delay
     for attempt in range(retries):
         data = reqapi.reqapi_ch_get_result(request_id)
         last_data = data
 
-        if not isinstance(data, dict):
-            time.sleep(delay)
-            continue
-
-        if len(data) == 0:
-            time.sleep(delay)
-            continue
-
-        if len(data) >= expected_nodes:
+        if isinstance(data, dict) and len(data) >= expected_nodes:
             if all(v is not None for v in data.values()):
                 break
             non_null = sum(1 for v in data.values() if v is not None)
             if non_null > 0 and attempt >= retries - 2:
                 break
 
-        time.sleep(delay)
+        # No point sleeping after the last call
+        if attempt < retries - 1:
+            time.sleep(wait)
+            wait = min(wait * 1.5, delay)
 
     return last_data
 
@@ -380,30 +881,134 @@ def wait_for_result(request_id: str, expected_nodes: int, retries: int = 10, del
 # ==============================
 #  Image Rendering Helpers
 # ==============================
+# Command handlers render here so PIL work never runs on the event loop
+RENDER_POOL = ThreadPoolExecutor(max_workers=2)
+
+
+async def render_async(render, *args):
+    """Run one render_* call in RENDER_POOL and await its BytesIO."""
+    return await asyncio.get_running_loop().run_in_executor(RENDER_POOL, render, *args)
+
+
+@functools.lru_cache(maxsize=None)
+def pil():
+    """(Image, ImageDraw, ImageFont), imported on the first render instead of at start-up."""
+    from PIL import Image, ImageDraw, ImageFont  # pip install pillow
+    return Image, ImageDraw, ImageFont
+
+
+@functools.lru_cache(maxsize=16)
 def get_font(size=14):
+    # Cached per size: fonts are read-only, so one object per size is enough
+    ImageFont = pil()[2]
     try:
         return ImageFont.truetype("arial.ttf", size)
     except Exception:
         return ImageFont.load_default()
 
 
+# Table layout / colors (shared by every render_table_image call)
+TABLE_PADDING_X = 20
+TABLE_PADDING_Y = 20
+TABLE_ROW_HEIGHT = 28
+TABLE_HEADER_HEIGHT = 32
+TABLE_COL_WIDTH = 170
+
+COLOR_BACKGROUND = (24, 24, 24)
+COLOR_TITLE = (255, 255, 255)
+COLOR_HEADER_BG = (50, 50, 50)
+COLOR_HEADER_LINE = (80, 80, 80)
+COLOR_ROW_LINE = (60, 60, 60)
+COLOR_TEXT = (230, 230, 230)
+# Indexed by the row's ok flag: [False, True]
+ROW_BG_COLORS = ((40, 28, 28), (30, 30, 30))
+STATUS_DOT_COLORS = ((244, 67, 54), (76, 175, 80))
+
+
+@functools.lru_cache(maxsize=16)
+def row_strip(width: int, ok: bool):
+    """
+    One table row's background and status dot, drawn once per (width, ok)
+    and pasted for every row instead of redrawing them. Read-only once built.
+    """
+    Image, ImageDraw, _ = pil()
+    strip = Image.new("RGB", (width, TABLE_ROW_HEIGHT), ROW_BG_COLORS[ok])
+    circle_x = 8
+    circle_y = TABLE_ROW_HEIGHT / 2
+    ImageDraw.Draw(strip).ellipse(
+        [circle_x - 5, circle_y - 5, circle_x + 5, circle_y + 5],
+        fill=STATUS_DOT_COLORS[ok]
+    )
+    return strip
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache whose entries also expire after ttl
+    seconds. get() returns None on a miss or an expired entry.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Rendered PNG bytes keyed by table content, so a /http right after the
+# monitor (or a repeated /stats) reuses the image instead of redrawing it
+IMAGE_CACHE = TTLCache(maxsize=64, ttl=CFG.interval)
+
+
 def render_table_image(title: str, columns, keys, rows):
     """
     columns: list of column titles
     keys: key names used in row dicts
     rows: list of dicts, each with keys + 'ok' (True/False)
     """
-    padding_x = 20
-    padding_y = 20
-    row_height = 28
-    header_height = 32
+    cache_key = (
+        title,
+        tuple(columns),
+        tuple(keys),
+        tuple(
+            (bool(row.get("ok", False)), *(str(row.get(key, "")) for key in keys))
+            for row in rows
+        ),
+    )
+    png = IMAGE_CACHE.get(cache_key)
+    if png is not None:
+        return BytesIO(png)
+
+    padding_x = TABLE_PADDING_X
+    padding_y = TABLE_PADDING_Y
+    row_height = TABLE_ROW_HEIGHT
+    header_height = TABLE_HEADER_HEIGHT
 
     col_count = len(columns)
-    col_width = 170
+    col_width = TABLE_COL_WIDTH
     width = padding_x * 2 + col_count * col_width
     height = padding_y * 2 + 30 + header_height + len(rows) * row_height + 20
 
-    img = Image.new("RGB", (width, height), (24, 24, 24))
+    Image, ImageDraw, _ = pil()
+    img = Image.new("RGB", (width, height), COLOR_BACKGROUND)
     draw = ImageDraw.Draw(img)
 
     font_title = get_font(18)
@@ -415,7 +1020,7 @@ def render_table_image(title: str, columns, keys, rows):
         (padding_x, padding_y),
         title,
         font=font_title,
-        fill=(255, 255, 255)
+        fill=COLOR_TITLE
     )
 
     table_top = padding_y + 30
@@ -425,62 +1030,60 @@ def render_table_image(title: str, columns, keys, rows):
     # Header background
     draw.rectangle(
         [table_left, table_top, table_right, table_top + header_height],
-        fill=(50, 50, 50)
+        fill=COLOR_HEADER_BG
     )
 
     # Header text
     for idx, col_name in enumerate(columns):
         x = table_left + idx * col_width + 10
         y = table_top + 8
-        draw.text((x, y), col_name, font=font_header, fill=(230, 230, 230))
+        draw.text((x, y), col_name, font=font_header, fill=COLOR_TEXT)
 
     # Header lines
     draw.line(
         [table_left, table_top, table_right, table_top],
-        fill=(80, 80, 80),
+        fill=COLOR_HEADER_LINE,
         width=1
     )
     draw.line(
         [table_left, table_top + header_height, table_right, table_top + header_height],
-        fill=(80, 80, 80),
+        fill=COLOR_HEADER_LINE,
         width=1
     )
 
-    # Rows
+    # Row-invariant geometry
+    cell_xs = [
+        table_left + c_idx * col_width + (20 if c_idx == 0 else 10)
+        for c_idx in range(len(keys))
+    ]
+    strip_width = table_right - table_left + 1
+
+    # Rows: each row owns [y, y + row_height - 1] and gets a prebuilt
+    # background + status dot strip. The line below a row is covered by
+    # the next row, so only the last separator is drawn.
     start_y = table_top + header_height
+    body_bottom = start_y + len(rows) * row_height
     for row_idx, row in enumerate(rows):
         y = start_y + row_idx * row_height
-        bg_color = (30, 30, 30) if row.get("ok", False) else (40, 28, 28)
-        draw.rectangle(
-            [table_left, y, table_right, y + row_height],
-            fill=bg_color
-        )
-
-        # Status circle
-        circle_x = table_left + 8
-        circle_y = y + row_height / 2
-        color = (76, 175, 80) if row.get("ok", False) else (244, 67, 54)
-        draw.ellipse(
-            [circle_x - 5, circle_y - 5, circle_x + 5, circle_y + 5],
-            fill=color
-        )
+        img.paste(row_strip(strip_width, bool(row.get("ok", False))), (table_left, y))
 
         # Cell text
-        for c_idx, key in enumerate(keys):
-            text = str(row.get(key, ""))
-            x = table_left + c_idx * col_width + (20 if c_idx == 0 else 10)
-            ty = y + 7
-            draw.text((x, ty), text, font=font_cell, fill=(230, 230, 230))
+        ty = y + 7
+        for x, key in zip(cell_xs, keys):
+            draw.text((x, ty), str(row.get(key, "")), font=font_cell, fill=COLOR_TEXT)
 
-        # Row separator
+    # Bottom separator
+    if rows:
         draw.line(
-            [table_left, y + row_height, table_right, y + row_height],
-            fill=(60, 60, 60),
+            [table_left, body_bottom, table_right, body_bottom],
+            fill=COLOR_ROW_LINE,
             width=1
         )
 
     buf = BytesIO()
-    img.save(buf, format="PNG")
+    # Flat-color tables compress well even at the fastest zlib level
+    img.save(buf, format="PNG", compress_level=1)
+    IMAGE_CACHE.put(cache_key, buf.getvalue())
     buf.seek(0)
     return buf
 
@@ -506,49 +1109,54 @@ def render_tcp_image(target: str, rows):
     return render_table_image(title, columns, keys, rows)
 
 
+def iter_stats_entries(stats_snapshot, mode_filter=None, target_filter=None):
+    """
+    Yield (mode, target, location, metric_name, metric_stats).
+    Filters are looked up directly instead of scanning every mode / target.
+    """
+    if mode_filter:
+        modes = [(mode_filter, stats_snapshot.get(mode_filter, {}))]
+    else:
+        modes = stats_snapshot.items()
+
+    for mode, targets in modes:
+        if target_filter:
+            targets = {target_filter: targets[target_filter]} if target_filter in targets else {}
+        for target, locations in targets.items():
+            for location, metrics in locations.items():
+                for metric_name, metric_stats in metrics.items():
+                    yield mode, target, location, metric_name, metric_stats
+
+
 def build_stats_rows(stats_snapshot, mode_filter=None, target_filter=None, max_rows=80):
     """
     Build flattened rows for stats table image.
     Each row: Mode, Target, Location, Metric, Mean, Std Dev, N
     """
     rows = []
-    for mode, targets in stats_snapshot.items():
-        if mode_filter and mode != mode_filter:
-            continue
-        for target, locations in targets.items():
-            if target_filter and target != target_filter:
-                continue
-            for location, metrics in locations.items():
-                for metric_name, metric_stats in metrics.items():
-                    n = metric_stats.get("n", 0)
-                    mean = metric_stats.get("mean", 0.0)
-                    M2 = metric_stats.get("M2", 0.0)
-                    if n > 1:
-                        variance = M2 / (n - 1)
-                        std = math.sqrt(max(variance, 0.0))
-                    else:
-                        std = 0.0
-
-                    if metric_name == "loss":
-                        mean_txt = f"{mean * 100:.2f} %"
-                        std_txt = f"{std * 100:.2f} %"
-                    else:
-                        mean_txt = f"{mean:.3f} s"
-                        std_txt = f"{std:.3f} s"
-
-                    rows.append({
-                        "mode": mode,
-                        "target": target,
-                        "location": location,
-                        "metric": metric_name,
-                        "mean": mean_txt,
-                        "std": std_txt,
-                        "n": str(n),
-                        "ok": True,
-                    })
-
-                    if len(rows) >= max_rows:
-                        return rows
+    entries = iter_stats_entries(stats_snapshot, mode_filter, target_filter)
+    # Only the rows that fit in the image are formatted
+    for mode, target, location, metric_name, metric_stats in itertools.islice(entries, max_rows):
+        n = metric_stats.get("n", 0)
+        mean, std = mean_std(n, metric_stats.get("s", 0.0), metric_stats.get("s2", 0.0))
+
+        if metric_name == "loss":
+            mean_txt = f"{mean * 100:.2f} %"
+            std_txt = f"{std * 100:.2f} %"
+        else:
+            mean_txt = f"{mean:.3f} s"
+            std_txt = f"{std:.3f} s"
+
+        rows.append({
+            "mode": mode,
+            "target": target,
+            "location": location,
+            "metric": metric_name,
+            "mean": mean_txt,
+            "std": std_txt,
+            "n": str(n),
+            "ok": True,
+        })
     return rows
 
 
@@ -574,7 +1182,7 @@ def http_check(domain: str, max_nodes: int):
     nodes = req.get("nodes", {})
     res = wait_for_result(request_id, expected_nodes=len(nodes))
 
-    msg = f"🔍 <b>HTTP Check</b>: <code>{html.escape(domain)}</code>\n\n"
+    parts = [f"🔍 <b>HTTP Check</b>: <code>{html.escape(domain)}</code>\n\n"]
     node_count = 0
     rows = []
 
@@ -602,20 +1210,16 @@ def http_check(domain: str, max_nodes: int):
 
         emoji = "🟢" if success_flag == 1 else "🔴"
 
-        msg += f"{emoji} <b>{html.escape(country)}, {html.escape(city)}</b>\n"
-        msg += f"📡 Result: <code>{html.escape(str(status_text))}</code>\n"
+        parts.append(f"{emoji} <b>{escape_cached(country)}, {escape_cached(city)}</b>\n")
+        parts.append(f"📡 Result: <code>{escape_cached(str(status_text))}</code>\n")
         if time_sec is not None:
-            msg += f"⏱ Time: <code>{time_sec:.3f} s</code>\n"
-        msg += f"📄 Code: <code>{html.escape(str(http_code))}</code>\n"
-        msg += f"🧩 IP (target): <code>{html.escape(str(ip))}</code>\n"
+            parts.append(f"⏱ Time: <code>{time_sec:.3f} s</code>\n")
+        parts.append(f"📄 Code: <code>{escape_cached(str(http_code))}</code>\n")
+        parts.append(f"🧩 IP (target): <code>{escape_cached(str(ip))}</code>\n")
         # Node info only when this node has an HTTP error
         if success_flag != 1:
-            msg += f"🛰 Node: <code>{html.escape(node_name)}</code>\n"
-            msg += (
-                "🔗 Node info: "
-                f"<code>https://check-host.net/ip-info?host={html.escape(node_name)}</code>\n"
-            )
-        msg += "------------------------------------\n"
+            parts.append(node_info_lines(node_name))
+        parts.append(f"{NODE_SEPARATOR}\n")
 
         rows.append({
             "location": f"{country}, {city}",
@@ -635,7 +1239,7 @@ def http_check(domain: str, max_nodes: int):
             []
         )
 
-    return msg, rows
+    return "".join(parts), rows
 
 
 # ==============================
@@ -650,7 +1254,7 @@ def ping_check(domain: str, max_nodes: int):
     nodes = req.get("nodes", {})
     res = wait_for_result(request_id, expected_nodes=len(nodes))
 
-    msg = f"🔍 <b>Ping Check</b>: <code>{html.escape(domain)}</code>\n\n"
+    parts = [f"🔍 <b>Ping Check</b>: <code>{html.escape(domain)}</code>\n\n"]
     node_count = 0
     rows = []
 
@@ -669,7 +1273,10 @@ def ping_check(domain: str, max_nodes: int):
 
         total = len(attempts)
         ok_count = 0
-        times = []
+        # RTT min / sum / max, accumulated in the same pass as the status
+        t_count = 0
+        t_sum = 0.0
+        t_min = t_max = None
         ip = "-"
 
         for att in attempts:
@@ -682,12 +1289,15 @@ def ping_check(domain: str, max_nodes: int):
             if status == "OK":
                 ok_count += 1
             if isinstance(t, (int, float)):
-                times.append(t)
-
-        if times:
-            t_min = min(times)
-            t_avg = sum(times) / len(times)
-            t_max = max(times)
+                t_count += 1
+                t_sum += t
+                if t_min is None or t < t_min:
+                    t_min = t
+                if t_max is None or t > t_max:
+                    t_max = t
+
+        if t_count:
+            t_avg = t_sum / t_count
             rtt_summary = f"{t_min:.3f} / {t_avg:.3f} / {t_max:.3f} s"
         else:
             t_avg = None
@@ -702,19 +1312,15 @@ def ping_check(domain: str, max_nodes: int):
 
         node_count += 1
 
-        msg += f"{emoji} <b>{html.escape(country)}, {html.escape(city)}</b>\n"
-        msg += f"📡 Result: <code>{html.escape(result_summary)}</code>\n"
-        msg += f"⏱ RTT: <code>{html.escape(rtt_summary)}</code>\n"
-        msg += f"📉 Loss: <code>{html.escape(loss_text)}</code>\n"
-        msg += f"🧩 IP (target): <code>{html.escape(str(ip))}</code>\n"
+        parts.append(f"{emoji} <b>{escape_cached(country)}, {escape_cached(city)}</b>\n")
+        parts.append(f"📡 Result: <code>{html.escape(result_summary)}</code>\n")
+        parts.append(f"⏱ RTT: <code>{html.escape(rtt_summary)}</code>\n")
+        parts.append(f"📉 Loss: <code>{html.escape(loss_text)}</code>\n")
+        parts.append(f"🧩 IP (target): <code>{escape_cached(str(ip))}</code>\n")
         # Node info only when there is packet loss
         if loss_rate is not None and loss_rate > 0.0:
-            msg += f"🛰 Node: <code>{html.escape(node_name)}</code>\n"
-            msg += (
-                "🔗 Node info: "
-                f"<code>https://check-host.net/ip-info?host={html.escape(node_name)}</code>\n"
-            )
-        msg += "------------------------------------\n"
+            parts.append(node_info_lines(node_name))
+        parts.append(f"{NODE_SEPARATOR}\n")
 
         rows.append({
             "location": f"{country}, {city}",
@@ -735,7 +1341,7 @@ def ping_check(domain: str, max_nodes: int):
             []
         )
 
-    return msg, rows
+    return "".join(parts), rows
 
 
 # ==============================
@@ -751,7 +1357,7 @@ def tcp_check(domain: str, port: str, max_nodes: int):
     nodes = req.get("nodes", {})
     res = wait_for_result(request_id, expected_nodes=len(nodes))
 
-    msg = f"🔍 <b>TCP Check</b>: <code>{html.escape(target)}</code>\n\n"
+    parts = [f"🔍 <b>TCP Check</b>: <code>{html.escape(target)}</code>\n\n"]
     node_count = 0
     rows = []
 
@@ -780,19 +1386,15 @@ def tcp_check(domain: str, port: str, max_nodes: int):
 
         node_count += 1
 
-        msg += f"{'🟢' if ok_flag else '🔴'} <b>{html.escape(country)}, {html.escape(city)}</b>\n"
-        msg += f"📡 Result: <code>{html.escape(str(result_text))}</code>\n"
+        parts.append(f"{'🟢' if ok_flag else '🔴'} <b>{escape_cached(country)}, {escape_cached(city)}</b>\n")
+        parts.append(f"📡 Result: <code>{escape_cached(str(result_text))}</code>\n")
         if time_sec is not None:
-            msg += f"⏱ Time: <code>{time_sec:.3f} s</code>\n"
-        msg += f"🧩 IP (target): <code>{html.escape(str(ip))}</code>\n"
+            parts.append(f"⏱ Time: <code>{time_sec:.3f} s</code>\n")
+        parts.append(f"🧩 IP (target): <code>{escape_cached(str(ip))}</code>\n")
         # Node info only when TCP is not connected
         if not ok_flag:
-            msg += f"🛰 Node: <code>{html.escape(node_name)}</code>\n"
-            msg += (
-                "🔗 Node info: "
-                f"<code>https://check-host.net/ip-info?host={html.escape(node_name)}</code>\n"
-            )
-        msg += "------------------------------------\n"
+            parts.append(node_info_lines(node_name))
+        parts.append(f"{NODE_SEPARATOR}\n")
 
         rows.append({
             "location": f"{country}, {city}",
@@ -812,7 +1414,7 @@ def tcp_check(domain: str, port: str, max_nodes: int):
             target
         )
 
-    return msg, rows, target
+    return "".join(parts), rows, target
 
 
 # ==============================
@@ -823,14 +1425,14 @@ async def start_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_allowed_chat_id(chat_id):
         return
 
-    targets = [t["host"] for t in CONFIG["targets"]]
+    targets = [t["host"] for t in CFG.targets]
     primary = targets[0] if targets else "https://yourdomain.com"
     clean = clean_host_for_ping(primary)
 
     txt = f"""
 🤖 Check-Host Monitoring Bot is running
 
-🔄 Auto monitoring every {CONFIG['interval'] // 60} minutes for:
+🔄 Auto monitoring every {CFG.interval // 60} minutes for:
 <code>{html.escape(str(targets))}</code>
 
 Available commands:
@@ -883,10 +1485,10 @@ async def http_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     domain = ctx.args[0]
-    msg, rows = http_check(domain, CONFIG["max_nodes"])
+    msg, rows = await asyncio.to_thread(http_check, domain, CFG.max_nodes)
     await send_large_async(update, msg)
     if rows:
-        img = render_http_image(domain, rows)
+        img = await render_async(render_http_image, domain, rows)
         await update.message.reply_photo(
             photo=img,
             caption=f"📊 <b>HTTP Result</b>: <code>{html.escape(domain)}</code>",
@@ -907,10 +1509,10 @@ async def ping_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     domain = ctx.args[0]
-    msg, rows = ping_check(domain, CONFIG["max_nodes"])
+    msg, rows = await asyncio.to_thread(ping_check, domain, CFG.max_nodes)
     await send_large_async(update, msg)
     if rows:
-        img = render_ping_image(domain, rows)
+        img = await render_async(render_ping_image, domain, rows)
         await update.message.reply_photo(
             photo=img,
             caption=f"📊 <b>Ping Result</b>: <code>{html.escape(domain)}</code>",
@@ -932,10 +1534,10 @@ async def tcp_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     domain = ctx.args[0]
     port = ctx.args[1]
-    msg, rows, target = tcp_check(domain, port, CONFIG["max_nodes"])
+    msg, rows, target = await asyncio.to_thread(tcp_check, domain, port, CFG.max_nodes)
     await send_large_async(update, msg)
     if rows:
-        img = render_tcp_image(target, rows)
+        img = await render_async(render_tcp_image, target, rows)
         await update.message.reply_photo(
             photo=img,
             caption=f"📊 <b>TCP Result</b>: <code>{html.escape(target)}</code>",
@@ -967,17 +1569,16 @@ async def stats_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         else:
             target_filter = ctx.args[0]
 
-    with STATS_LOCK:
-        stats_snapshot = json.loads(json.dumps(STATS))
-
-    if not stats_snapshot:
+    if not STATS:
         await send_large_async(
             update,
             "🚫 No statistics available yet. Let the monitor run for a while."
         )
         return
 
-    img = render_stats_image(stats_snapshot, mode_filter, target_filter)
+    # Only the part of STATS the filter asks for is copied
+    stats_snapshot = snapshot_stats(mode_filter, target_filter)
+    img = await render_async(render_stats_image, stats_snapshot, mode_filter, target_filter)
     if img is None:
         await send_large_async(
             update,
@@ -999,225 +1600,485 @@ async def stats_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# ==============================
+#  Monitor Targets
+# ==============================
+def prepare_target(target: dict) -> dict:
+    """
+    Resolve a CONFIG target once: the host/port actually checked and the
+    escaped strings every report and alert for it reuses.
+    """
+    host = target["host"]
+    mode = target["mode"]
+    port = str(target.get("port", 443))
+
+    if mode == "http":
+        checked = host
+        prefix = "🟢 <b>HTTP Monitor</b>"
+        title = "HTTP Check"
+    elif mode == "ping":
+        checked = clean_host_for_ping(host)
+        prefix = "🟢 <b>Ping Monitor</b>"
+        title = "Ping Check"
+    elif mode == "tcp":
+        checked = f"{clean_host_for_ping(host)}:{port}"
+        prefix = f"🟢 <b>TCP Monitor {html.escape(port)}</b>"
+        title = "TCP Check"
+    else:
+        checked = host
+        prefix = ""
+        title = ""
+
+    checked_esc = html.escape(checked)
+    return {
+        "host": host,
+        "mode": mode,
+        "port": port,
+        "checked": checked,
+        "host_esc": html.escape(host),
+        "mode_esc": html.escape(mode),
+        "checked_esc": checked_esc,
+        "prefix": prefix,
+        "caption": f"{prefix}\n🔍 <b>{title}</b>: <code>{checked_esc}</code>",
+    }
+
+
+# Built once at import; the monitor iterates this instead of CFG.targets
+TARGETS = [prepare_target(t) for t in CFG.targets]
+
+
+def run_check(target: dict):
+    """Run the check for one prepared target; returns (msg, rows)."""
+    mode = target["mode"]
+
+    if mode == "http":
+        return http_check(target["host"], CFG.max_nodes)
+    if mode == "ping":
+        return ping_check(target["checked"], CFG.max_nodes)
+    if mode == "tcp":
+        msg, rows, _ = tcp_check(clean_host_for_ping(target["host"]), target["port"], CFG.max_nodes)
+        return msg, rows
+    return None
+
+
+# ==============================
+#  Alert Node Blocks
+# ==============================
+_NODE_BLOCK_HEAD = (
+    "{dot} <b>{location}</b>\n"
+    "📡 Result: <code>{result}</code>\n"
+)
+_NODE_BLOCK_TAIL = (
+    "🧩 IP (target): <code>{ip}</code>\n"
+    "{node_info}"
+)
+
+# Node details appended to an alert, filled from escape_row()
+NODE_BLOCK_TMPL = {
+    "http": (
+        _NODE_BLOCK_HEAD
+        + "⏱ Time: <code>{time}</code>\n"
+        + "📄 Code: <code>{code}</code>\n"
+        + _NODE_BLOCK_TAIL
+    ),
+    "ping": (
+        _NODE_BLOCK_HEAD
+        + "⏱ RTT: <code>{rtt}</code>\n"
+        + "📉 Loss: <code>{loss}</code>\n"
+        + _NODE_BLOCK_TAIL
+    ),
+    "tcp": (
+        _NODE_BLOCK_HEAD
+        + "⏱ Time: <code>{time}</code>\n"
+        + _NODE_BLOCK_TAIL
+    ),
+}
+
+
+def escape_row(row) -> dict:
+    """HTML-escaped text fields of a result row, plus its status dot and node lines."""
+    esc = {k: escape_cached(v) for k, v in row.items() if isinstance(v, str)}
+    esc["dot"] = "🟢" if row.get("ok") else "🔴"
+    esc["node_info"] = node_info_lines(row["node"])
+    return esc
+
+
+# ==============================
+#  Alert Throttling
+# ==============================
+# (mode, target, node, metric) -> monotonic time of its last alert. Keyed
+# by node, not location: several check-host nodes can share a location.
+# Keys of one target are only touched by that target's own probe.
+LAST_ALERT = {}
+
+
+def should_alert(key, firing: bool) -> bool:
+    """
+    True if an alert for key should be sent now. A firing key alerts once,
+    then stays quiet for ALERT_COOLDOWN while it keeps firing; once the
+    condition clears, the next trigger alerts right away.
+    """
+    if not firing:
+        LAST_ALERT.pop(key, None)
+        return False
+    now = time.monotonic()
+    last = LAST_ALERT.get(key)
+    if last is not None and now - last < ALERT_COOLDOWN:
+        return False
+    LAST_ALERT[key] = now
+    return True
+
+
 # ==============================
 #  Auto Monitoring Loop
 # ==============================
-def auto_monitor():
-    while True:
-        for target in CONFIG["targets"]:
-            host = target["host"]
-            mode = target["mode"]
-
-            try:
-                if mode == "http":
-                    msg, rows = http_check(host, CONFIG["max_nodes"])
-                    prefix = "🟢 <b>HTTP Monitor</b>"
-                    send_large_auto(f"{prefix}\n\n{msg}")
-
-                    alerts = []
-                    for row in rows:
-                        if not row.get("ok"):
-                            # optional: you can also add pure "HTTP error" alerts here
-                            continue
-                        value = row.get("time_value")
-                        if value is None:
-                            continue
-
-                        node_block = (
-                            f"{'🟢' if row.get('ok') else '🔴'} "
-                            f"<b>{html.escape(row['location'])}</b>\n"
-                            f"📡 Result: <code>{html.escape(row['result'])}</code>\n"
-                            f"⏱ Time: <code>{html.escape(row['time'])}</code>\n"
-                            f"📄 Code: <code>{html.escape(row['code'])}</code>\n"
-                            f"🧩 IP (target): <code>{html.escape(row['ip'])}</code>\n"
-                            f"🛰 Node: <code>{html.escape(row['node'])}</code>\n"
-                            "🔗 Node info: "
-                            f"<code>https://check-host.net/ip-info?host={html.escape(row['node'])}</code>\n"
-                        )
-
-                        is_anomaly, details = update_and_detect(
-                            mode="http",
-                            target=host,
-                            location=row["location"],
-                            metric_name="time",
-                            value=value,
-                        )
-                        if is_anomaly and details:
-                            alerts.append(
-                                f"⚠️ <b>HTTP Anomaly</b> for <code>{html.escape(host)}</code> at "
-                                f"<b>{html.escape(row['location'])}</b>\n"
-                                f"⏱ Current: <code>{value:.3f} s</code>\n"
-                                f"📊 Previous mean ({details['n']} samples): "
-                                f"<code>{details['mean']:.3f} s</code>\n"
-                                f"σ ≈ <code>{details['std']:.3f}</code> | "
-                                f"factor ≈ <code>{details['factor']:.2f}x</code>\n\n"
-                                f"{node_block}"
-                            )
-
-                    if alerts:
-                        send_large_auto("\n\n".join(alerts))
-
-                    if rows:
-                        img = render_http_image(host, rows)
-                        telegram_send_photo(
-                            img,
-                            caption=f"{prefix}\n🔍 <b>HTTP Check</b>: <code>{html.escape(host)}</code>"
-                        )
-
-                elif mode == "ping":
-                    d = clean_host_for_ping(host)
-                    msg, rows = ping_check(d, CONFIG["max_nodes"])
-                    prefix = "🟢 <b>Ping Monitor</b>"
-                    send_large_auto(f"{prefix}\n\n{msg}")
-
-                    alerts = []
-                    for row in rows:
-                        node_block = (
-                            f"{'🟢' if row.get('ok') else '🔴'} "
-                            f"<b>{html.escape(row['location'])}</b>\n"
-                            f"📡 Result: <code>{html.escape(row['result'])}</code>\n"
-                            f"⏱ RTT: <code>{html.escape(row['rtt'])}</code>\n"
-                            f"📉 Loss: <code>{html.escape(row['loss'])}</code>\n"
-                            f"🧩 IP (target): <code>{html.escape(row['ip'])}</code>\n"
-                            f"🛰 Node: <code>{html.escape(row['node'])}</code>\n"
-                            "🔗 Node info: "
-                            f"<code>https://check-host.net/ip-info?host={html.escape(row['node'])}</code>\n"
-                        )
-
-                        # RTT anomaly (only for "ok" nodes with valid RTT average)
-                        rtt_value = row.get("rtt_avg_value")
-                        if rtt_value is not None and row.get("ok"):
-                            is_anomaly_rtt, details_rtt = update_and_detect(
-                                mode="ping",
-                                target=d,
-                                location=row["location"],
-                                metric_name="rtt",
-                                value=rtt_value,
-                            )
-                            if is_anomaly_rtt and details_rtt:
-                                alerts.append(
-                                    f"⚠️ <b>Ping RTT Anomaly</b> for <code>{html.escape(d)}</code> at "
-                                    f"<b>{html.escape(row['location'])}</b>\n"
-                                    f"⏱ Current avg RTT: <code>{rtt_value:.3f} s</code>\n"
-                                    f"📊 Previous mean ({details_rtt['n']} samples): "
-                                    f"<code>{details_rtt['mean']:.3f} s</code>\n"
-                                    f"σ ≈ <code>{details_rtt['std']:.3f}</code> | "
-                                    f"factor ≈ <code>{details_rtt['factor']:.2f}x</code>\n\n"
-                                    f"{node_block}"
-                                )
-
-                        # Packet Loss anomaly / detection
-                        loss_rate = row.get("loss_rate")
-                        if loss_rate is not None:
-                            is_anomaly_loss, details_loss = update_and_detect(
-                                mode="ping",
-                                target=d,
-                                location=row["location"],
-                                metric_name="loss",
-                                value=loss_rate,
-                            )
-
-                            if is_anomaly_loss and details_loss:
-                                alerts.append(
-                                    f"⚠️ <b>Ping Loss Anomaly</b> for "
-                                    f"<code>{html.escape(d)}</code> at "
-                                    f"<b>{html.escape(row['location'])}</b>\n"
-                                    f"📉 Current loss: <code>{loss_rate * 100:.1f} %</code>\n"
-                                    f"📊 Previous mean loss ({details_loss['n']} samples): "
-                                    f"<code>{details_loss['mean'] * 100:.2f} %</code>\n\n"
-                                    f"{node_block}"
-                                )
-                            elif loss_rate > 0.0:
-                                alerts.append(
-                                    f"⚠️ <b>Ping Loss Detected</b> for "
-                                    f"<code>{html.escape(d)}</code> at "
-                                    f"<b>{html.escape(row['location'])}</b>\n"
-                                    f"📉 Loss: <code>{loss_rate * 100:.1f} %</code>\n\n"
-                                    f"{node_block}"
-                                )
-
-                    if alerts:
-                        send_large_auto("\n\n".join(alerts))
-
-                    if rows:
-                        img = render_ping_image(d, rows)
-                        telegram_send_photo(
-                            img,
-                            caption=f"{prefix}\n🔍 <b>Ping Check</b>: <code>{html.escape(d)}</code>"
-                        )
-
-                elif mode == "tcp":
-                    d = clean_host_for_ping(host)
-                    port = str(target.get("port", 443))
-                    msg, rows, tcp_target = tcp_check(d, port, CONFIG["max_nodes"])
-                    prefix = f"🟢 <b>TCP Monitor {html.escape(port)}</b>"
-                    send_large_auto(f"{prefix}\n\n{msg}")
-
-                    alerts = []
-                    for row in rows:
-                        if not row.get("ok"):
-                            # also could alert on raw TCP errors if you want
-                            continue
-                        value = row.get("time_value")
-                        if value is None:
-                            continue
-
-                        node_block = (
-                            f"{'🟢' if row.get('ok') else '🔴'} "
-                            f"<b>{html.escape(row['location'])}</b>\n"
-                            f"📡 Result: <code>{html.escape(row['result'])}</code>\n"
-                            f"⏱ Time: <code>{html.escape(row['time'])}</code>\n"
-                            f"🧩 IP (target): <code>{html.escape(row['ip'])}</code>\n"
-                            f"🛰 Node: <code>{html.escape(row['node'])}</code>\n"
-                            "🔗 Node info: "
-                            f"<code>https://check-host.net/ip-info?host={html.escape(row['node'])}</code>\n"
-                        )
-
-                        is_anomaly, details = update_and_detect(
-                            mode="tcp",
-                            target=tcp_target,
-                            location=row["location"],
-                            metric_name="time",
-                            value=value,
-                        )
-                        if is_anomaly and details:
-                            alerts.append(
-                                f"⚠️ <b>TCP Anomaly</b> for <code>{html.escape(tcp_target)}</code> at "
-                                f"<b>{html.escape(row['location'])}</b>\n"
-                                f"⏱ Current connect time: <code>{value:.3f} s</code>\n"
-                                f"📊 Previous mean ({details['n']} samples): "
-                                f"<code>{details['mean']:.3f} s</code>\n"
-                                f"σ ≈ <code>{details['std']:.3f}</code> | "
-                                f"factor ≈ <code>{details['factor']:.2f}x</code>\n\n"
-                                f"{node_block}"
-                            )
-
-                    if alerts:
-                        send_large_auto("\n\n".join(alerts))
-
-                    if rows:
-                        img = render_tcp_image(tcp_target, rows)
-                        telegram_send_photo(
-                            img,
-                            caption=f"{prefix}\n🔍 <b>TCP Check</b>: <code>{html.escape(tcp_target)}</code>"
-                        )
-
-            except Exception as e:
-                send_large_auto(
-                    f"❌ Error in monitoring {html.escape(host)} ({html.escape(mode)}):\n"
-                    f"{html.escape(str(e))}"
-                )
-
-        time.sleep(CONFIG["interval"])
+# A check that could not be started (CheckNotStarted) is retried after
+# 2, 4, 8, ... s (capped at MONITOR_MAX_BACKOFF), at most MONITOR_RETRIES
+# times and never past the start of the next cycle. Any other failure is
+# reported right away: the check may already be running on check-host,
+# and starting it again would spend API quota on a duplicate.
+MONITOR_RETRIES = 5
+MONITOR_MAX_BACKOFF = 300
+
+# How long shutdown waits for a running cycle before cancelling it (seconds)
+MONITOR_STOP_GRACE = 10.0
+
+# Monitor passes block for the whole check-host poll and the Telegram rate
+# limiter, so they get their own threads instead of the loop's default
+# executor, which the command handlers' checks use: one per concurrent
+# check, plus one that delivers the results
+MONITOR_POOL = ThreadPoolExecutor(max_workers=CFG.concurrency + 1)
+
+
+def report_monitor_error(target: dict, error: Exception):
+    """Report a failed pass; a target that keeps failing is reported once per ALERT_COOLDOWN."""
+    if should_alert((target["mode"], target["checked"], None, "error"), True):
+        send_large_auto(
+            f"❌ Error in monitoring {target['host_esc']} ({target['mode_esc']}):\n"
+            f"{html.escape(str(error))}"
+        )
+
+
+def monitor_target(target: dict, check):
+    """
+    The rest of one monitoring pass once run_check() returned check:
+    report, update baselines, alert. Runs once per pass, never retried.
+    """
+    host = target["host"]
+    mode = target["mode"]
+    target_esc = target["checked_esc"]
+    prefix = target["prefix"]
+
+    try:
+        if mode == "http":
+            msg, rows = check
+
+            sample_rows = []
+            for row in rows:
+                if not row.get("ok"):
+                    # optional: you can also add pure "HTTP error" alerts here
+                    continue
+                if row.get("time_value") is None:
+                    continue
+                sample_rows.append(row)
+
+            results = update_target_and_detect(
+                "http", host,
+                [row["location"] for row in sample_rows],
+                ["time"] * len(sample_rows),
+                [row["time_value"] for row in sample_rows],
+            )
+
+            # Report, then one "\n\n"-separated block per alert; joined once
+            parts = [prefix, "\n\n", msg]
+            for row, (is_anomaly, details) in zip(sample_rows, results):
+                key = ("http", host, row["node"], "time")
+                if should_alert(key, bool(is_anomaly and details)):
+                    value = row["time_value"]
+                    esc = escape_row(row)
+                    parts.extend((
+                        "\n\n",
+                        f"⚠️ <b>HTTP Anomaly</b> for <code>{target_esc}</code> at "
+                        f"<b>{esc['location']}</b>\n"
+                        f"⏱ Current: <code>{value:.3f} s</code>\n"
+                        f"📊 Previous mean ({details['n']} samples): "
+                        f"<code>{details['mean']:.3f} s</code>\n"
+                        f"σ ≈ <code>{details['std']:.3f}</code> | "
+                        f"factor ≈ <code>{details['factor']:.2f}x</code>\n",
+                        NODE_BLOCK_TMPL['http'].format_map(esc),
+                    ))
+
+            send_large_auto("".join(parts))
+
+            if rows:
+                img = render_http_image(host, rows)
+                telegram_send_photo(img, caption=target["caption"])
+
+        elif mode == "ping":
+            d = target["checked"]
+            msg, rows = check
+
+            # Columnar samples, plus (rtt index, loss index) into them per row
+            locations = []
+            metric_names = []
+            values = []
+            sample_idx = []
+            for row in rows:
+                rtt_i = None
+                loss_i = None
+
+                # RTT model (only for "ok" nodes with valid RTT average)
+                rtt_value = row.get("rtt_avg_value")
+                if rtt_value is not None and row.get("ok"):
+                    rtt_i = len(values)
+                    locations.append(row["location"])
+                    metric_names.append("rtt")
+                    values.append(rtt_value)
+
+                # Packet loss model
+                loss_rate = row.get("loss_rate")
+                if loss_rate is not None:
+                    loss_i = len(values)
+                    locations.append(row["location"])
+                    metric_names.append("loss")
+                    values.append(loss_rate)
+
+                sample_idx.append((rtt_i, loss_i))
+
+            results = update_target_and_detect("ping", d, locations, metric_names, values)
+
+            # Report, then one "\n\n"-separated block per alert; joined once
+            parts = [prefix, "\n\n", msg]
+            for row, (rtt_i, loss_i) in zip(rows, sample_idx):
+                esc = None  # escaped on the first alert for this row
+                # RTT anomaly
+                if rtt_i is not None:
+                    is_anomaly_rtt, details_rtt = results[rtt_i]
+                    key = ("ping", d, row["node"], "rtt")
+                    if should_alert(key, bool(is_anomaly_rtt and details_rtt)):
+                        rtt_value = row["rtt_avg_value"]
+                        esc = esc or escape_row(row)
+                        parts.extend((
+                            "\n\n",
+                            f"⚠️ <b>Ping RTT Anomaly</b> for <code>{target_esc}</code> at "
+                            f"<b>{esc['location']}</b>\n"
+                            f"⏱ Current avg RTT: <code>{rtt_value:.3f} s</code>\n"
+                            f"📊 Previous mean ({details_rtt['n']} samples): "
+                            f"<code>{details_rtt['mean']:.3f} s</code>\n"
+                            f"σ ≈ <code>{details_rtt['std']:.3f}</code> | "
+                            f"factor ≈ <code>{details_rtt['factor']:.2f}x</code>\n",
+                            NODE_BLOCK_TMPL['ping'].format_map(esc),
+                        ))
+
+                # Packet Loss anomaly / detection
+                if loss_i is not None:
+                    loss_rate = row["loss_rate"]
+                    is_anomaly_loss, details_loss = results[loss_i]
+                    is_anomaly_loss = bool(is_anomaly_loss and details_loss)
+                    # Loss that is not anomalous is only reported when it is high
+                    key = ("ping", d, row["node"], "loss")
+                    if should_alert(key, is_anomaly_loss or loss_rate >= LOSS_ALERT_THRESHOLD):
+                        esc = esc or escape_row(row)
+                        if is_anomaly_loss:
+                            parts.extend((
+                                "\n\n",
+                                f"⚠️ <b>Ping Loss Anomaly</b> for "
+                                f"<code>{target_esc}</code> at "
+                                f"<b>{esc['location']}</b>\n"
+                                f"📉 Current loss: <code>{loss_rate * 100:.1f} %</code>\n"
+                                f"📊 Previous mean loss ({details_loss['n']} samples): "
+                                f"<code>{details_loss['mean'] * 100:.2f} %</code>\n",
+                                NODE_BLOCK_TMPL['ping'].format_map(esc),
+                            ))
+                        else:
+                            parts.extend((
+                                "\n\n",
+                                f"⚠️ <b>Ping Loss Detected</b> for "
+                                f"<code>{target_esc}</code> at "
+                                f"<b>{esc['location']}</b>\n"
+                                f"📉 Loss: <code>{loss_rate * 100:.1f} %</code>\n",
+                                NODE_BLOCK_TMPL['ping'].format_map(esc),
+                            ))
+
+            send_large_auto("".join(parts))
+
+            if rows:
+                img = render_ping_image(d, rows)
+                telegram_send_photo(img, caption=target["caption"])
+
+        elif mode == "tcp":
+            tcp_target = target["checked"]
+            msg, rows = check
+
+            sample_rows = []
+            for row in rows:
+                if not row.get("ok"):
+                    # also could alert on raw TCP errors if you want
+                    continue
+                if row.get("time_value") is None:
+                    continue
+                sample_rows.append(row)
+
+            results = update_target_and_detect(
+                "tcp", tcp_target,
+                [row["location"] for row in sample_rows],
+                ["time"] * len(sample_rows),
+                [row["time_value"] for row in sample_rows],
+            )
+
+            # Report, then one "\n\n"-separated block per alert; joined once
+            parts = [prefix, "\n\n", msg]
+            for row, (is_anomaly, details) in zip(sample_rows, results):
+                key = ("tcp", tcp_target, row["node"], "time")
+                if should_alert(key, bool(is_anomaly and details)):
+                    value = row["time_value"]
+                    esc = escape_row(row)
+                    parts.extend((
+                        "\n\n",
+                        f"⚠️ <b>TCP Anomaly</b> for <code>{target_esc}</code> at "
+                        f"<b>{esc['location']}</b>\n"
+                        f"⏱ Current connect time: <code>{value:.3f} s</code>\n"
+                        f"📊 Previous mean ({details['n']} samples): "
+                        f"<code>{details['mean']:.3f} s</code>\n"
+                        f"σ ≈ <code>{details['std']:.3f}</code> | "
+                        f"factor ≈ <code>{details['factor']:.2f}x</code>\n",
+                        NODE_BLOCK_TMPL['tcp'].format_map(esc),
+                    ))
+
+            send_large_auto("".join(parts))
+
+            if rows:
+                img = render_tcp_image(tcp_target, rows)
+                telegram_send_photo(img, caption=target["caption"])
+
+    except Exception as e:
+        report_monitor_error(target, e)
+        return
+
+    should_alert((mode, target["checked"], None, "error"), False)
+
+
+async def auto_monitor(stop: asyncio.Event):
+    """
+    Runs on the bot's event loop until stop is set. Every interval all
+    targets are checked concurrently (each in a MONITOR_POOL thread, at
+    most CFG.concurrency at a time), so a cycle takes about as long as
+    its slowest target. A check that could not be started is retried
+    with exponential backoff within its cycle.
+    Results are merged, reported and alerted one target at a time in
+    TARGETS order, each as soon as it and all earlier ones are done, so
+    reports and photos of different targets never interleave.
+    Cycles start on a fixed monotonic cadence; a cycle that overruns the
+    interval drops the missed ticks and the next one starts right away.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(CFG.concurrency)
+
+    async def pause(seconds: float) -> bool:
+        """Sleep for seconds; True if stop was set meanwhile."""
+        try:
+            await asyncio.wait_for(stop.wait(), seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def probe_one(target, deadline):
+        """
+        Run the target's check; returns (check, error), both None if stop
+        was set. Only a check that never started is retried.
+        """
+        error = None
+        for attempt in range(MONITOR_RETRIES + 1):
+            if attempt:
+                backoff = min(MONITOR_MAX_BACKOFF, 2 ** attempt)
+                if time.monotonic() + backoff >= deadline:
+                    break
+                if await pause(backoff):
+                    return None, None
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(MONITOR_POOL, run_check, target), None
+                except CheckNotStarted as e:
+                    error = e
+                except Exception as e:
+                    error = e
+                    break
+        return None, error
+
+    async def deliver(target, check, error):
+        """Merge and report one target's check (exactly once), or report its error."""
+        try:
+            if check is not None:
+                await loop.run_in_executor(MONITOR_POOL, monitor_target, target, check)
+            elif error is not None:
+                await loop.run_in_executor(MONITOR_POOL, report_monitor_error, target, error)
+        except Exception:
+            # even the error report failed (e.g. Telegram unreachable)
+            pass
+
+    next_tick = time.monotonic()
+    while not stop.is_set():
+        deadline = next_tick + CFG.interval
+        probes = [asyncio.ensure_future(probe_one(target, deadline)) for target in TARGETS]
+        try:
+            for target, probe in zip(TARGETS, probes):
+                await deliver(target, *await probe)
+        finally:
+            # only left pending if the monitor itself is cancelled
+            for probe in probes:
+                probe.cancel()
+        await loop.run_in_executor(MONITOR_POOL, maybe_flush_stats)
+
+        next_tick = deadline
+        delay = next_tick - time.monotonic()
+        if delay < 0:
+            next_tick = time.monotonic()
+            delay = 0
+        if await pause(delay):
+            break
+
+
+async def start_monitor(app):
+    stop = asyncio.Event()
+    app.bot_data["monitor_stop"] = stop
+    app.bot_data["monitor_task"] = asyncio.create_task(auto_monitor(stop))
+
+
+async def stop_monitor(app):
+    """Let a running cycle finish (up to MONITOR_STOP_GRACE), then cancel the monitor."""
+    stop = app.bot_data.pop("monitor_stop", None)
+    task = app.bot_data.pop("monitor_task", None)
+    if stop is not None:
+        stop.set()
+    if task is not None:
+        try:
+            await asyncio.wait_for(task, MONITOR_STOP_GRACE)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+
+
+async def release_resources(app):
+    """Flush stats and close the pooled sessions and worker threads on shutdown."""
+    await asyncio.to_thread(maybe_flush_stats, 0.0)
+    MONITOR_POOL.shutdown(wait=False, cancel_futures=True)
+    RENDER_POOL.shutdown(wait=False, cancel_futures=True)
+    TELEGRAM_POOL.shutdown(wait=False, cancel_futures=True)
+    CHECKHOST_SESSION.close()
+    TELEGRAM_SESSION.close()
 
 
 # ==============================
 #  Main
 # ==============================
 def main():
-    threading.Thread(target=auto_monitor, daemon=True).start()
-
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .post_init(start_monitor)
+        .post_stop(stop_monitor)
+        .post_shutdown(release_resources)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start_cmd))
     app.add_handler(CommandHandler("http", http_cmd))
     app.add_handler(CommandHandler("ping", ping_cmd))